@@ -0,0 +1,648 @@
+#!/usr/bin/env python3
+
+import os
+import io
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import contextlib
+import subprocess
+import tracemalloc
+import json_combiner
+import json_generator
+
+"""
+    Benchmarks for the model registry scripts
+    (json_generator.py and json_combiner.py)
+"""
+
+"""
+    Usage:
+    ./json_bench.py [--known N] [--incoming N] [--budget SECONDS]
+    ./json_bench.py --parse [--models DIR] [--count N] [--doc_lines N]
+
+    --known: number of models already in models.json (default 100000)
+    --incoming: number of models from *_model.json files (default 100000)
+        Half of them update known models, the other half are new
+    --budget: fail (exit 1) if merging takes longer than this many seconds
+
+    --parse: instead, check json_generator.parse_docstring() against the
+        line by line parser it replaced, then time both
+        Every file must give the same fields, errors and messages from
+        both parsers, or the script exits with 1
+    --models: directory of model files to parse (default: a synthetic tree
+        of --count models with --doc_lines long docs, plus edge cases)
+
+    ./json_bench.py --suite [--sizes N,N...] [--doc_lines N]
+                    [--known_ratio R] [--renamed_ratio R]
+                    [--out FP] [--compare FP] [--tolerance X]
+
+    --suite: instead, build a synthetic model tree of each size (default
+        10, 1000 and 100000 models, with --doc_lines long docs) and time
+        each phase of a registry build on it separately: parse (every
+        docstring), merge (into a registry holding --known_ratio of the
+        models, --renamed_ratio of which have since changed source),
+        serialize (write models.json) and load (stream it back in)
+        Each phase also reports its peak memory (traced in a second run)
+    --out: save the results as JSON, to compare against in later commits
+    --compare: print each phase against the results saved in this file,
+        and exit with 1 if any is more than --tolerance times slower
+
+    ./json_bench.py --importtime [--runs N] [--import_budget MS]
+
+    --importtime: instead, import each registry script in a fresh
+        interpreter (python -X importtime) and report how long it took,
+        with the slowest modules it pulled in
+        The best of --runs runs (default 5) counts, and the script exits
+        with 1 if any takes longer than --import_budget milliseconds
+        (default 100). -X importtime needs Python 3.7 or later
+"""
+
+MIN_COMPARE_SECONDS = 0.01  # --compare ignores phases faster than this
+IMPORT_MODULES = ["json_generator", "json_combiner", "json_watcher"]
+IMPORT_TOP = 3  # slowest imports listed per script
+
+script_name = sys.argv[0]
+
+
+def script_output(message, withName=True):  # (str, bool) -> None
+    """
+        Wrapper for print to include the script's name
+    """
+    if(withName is True):
+        print(script_name + ": " + message)
+    else:
+        print(message)
+
+
+def make_model(number):  # (int) -> dict
+    """
+        Makes a synthetic model, as json_generator.py would parse it
+    """
+    name = "model" + str(number)
+    return {
+        "name": name,
+        "run": name,
+        "props": "props/" + name + ".props.json",
+        "doc": "Synthetic model number " + str(number),
+        "source": "models/" + name + ".py",
+        "graph": "scatter",
+        "active": True,
+    }
+
+
+def make_registry(num_known, num_incoming):
+    """
+        Makes num_known known models (with IDs, as read from models.json)
+        and num_incoming models, half of which update known models
+        params: (int, int) -> ([dict...], [dict...])
+    """
+    known_models = []
+    for number in range(num_known):
+        model = make_model(number)
+        model[json_combiner.ID_FIELD] = number
+        known_models.append(model)
+
+    num_updates = min(num_incoming // 2, num_known)
+    models = [make_model(number) for number in range(num_updates)]
+    models.extend(make_model(num_known + number)
+                  for number in range(num_incoming - num_updates))
+
+    return (models, known_models)
+
+
+# Model files the parsers have to agree on, beyond the synthetic ones
+EDGE_CASES = {
+    "no_docstring.py": "import sys\n",
+    "empty.py": "",
+    "comment_first.py": "# comment\n\n\"\"\"\n    name: a\n    run: a\n"
+    "    props: a\n    doc: a\n    source: a\n    graph: a\n"
+    "    active: yes\n\"\"\"\n",
+    "single_quotes.py": "\'\'\'\n    name: a\n    run: 3\n    props: null\n"
+    "    doc: a\n\n    more doc\n    source: a\n    graph: a\n"
+    "    active: off\n\'\'\'\n",
+    "unknown_key.py": "\"\"\"\n    name: a\n    colour: red\n\"\"\"\n",
+    "duplicate_key.py": "\"\"\"\n    name: a\n    name: b\n\"\"\"\n",
+    "missing_fields.py": "\"\"\"\n    name: a\n    run: a\n\"\"\"\n",
+    "no_fields.py": "\"\"\"\n    A plain docstring.\n\"\"\"\n",
+    "same_line.py": "\"\"\"name: a\n    run: a\n\"\"\"\n",
+    "empty_docstring.py": "\"\"\"\n\"\"\"\n",
+    "blank_lines.py": "\"\"\"\n\n    name: a\n    run: a\n    props: a\n"
+    "    doc: a: b\n    source: a,\n    graph: a\n    active: 0\n\n"
+    "\"\"\"\nx = 1\n",
+    "one_line_docstring.py": "\"\"\"Helper utilities.\"\"\"\nimport os\n",
+    "one_line_then_fields.py": "\"\"\"Helper.\"\"\"\n\"\"\"\n    name: a\n"
+    "\"\"\"\n",
+    "fields_after_code.py": "import os\nimport sys\n\n\"\"\"\n    name: a\n"
+    "    run: a\n    props: a\n    doc: a\n    source: a\n    graph: a\n"
+    "    active: yes\n\"\"\"\n",
+    "quotes_in_comment.py": "# no \"\"\" here\n\"\"\"\n    name: a\n\"\"\"\n",
+    "mixed_quotes.py": "\"\"\"\n    name: a\n    doc: it'''s\n    run: a\n"
+    "\"\"\"\n",
+}
+
+
+def write_model_tree(dest_dir, count, doc_lines):  # (str, int, int) -> None
+    """
+        Writes count synthetic model files, with doc_lines long docs,
+        into dest_dir
+    """
+    for number in range(count):
+        model = make_model(number)
+        doc = "\n        ".join(model["doc"] + " line " + str(line)
+                                for line in range(doc_lines))
+        with open(os.path.join(dest_dir, model["name"] + ".py"), 'w') \
+                as output_stream:
+            output_stream.write(
+                '"""\n' +
+                "    name: " + model["name"] + "\n" +
+                "    run: " + model["run"] + "\n" +
+                "    props: " + model["props"] + "\n" +
+                "    doc: " + doc + "\n" +
+                "    source: " + model["source"] + "\n" +
+                "    graph: " + model["graph"] + "\n" +
+                "    active: true\n" +
+                '"""\n\n' +
+                "def main():\n    return 0\n")
+
+
+def legacy_parse_docstring(file_path):
+    """
+        The line by line parser json_generator.parse_docstring() replaced,
+        kept as the reference for --parse
+    """
+    gen = json_generator
+    with open(file_path, 'r') as input_stream:
+        docstring_content = []
+        num_indicator = 0  # Indicators of docstring quotes
+        while(num_indicator < 2):
+            line = input_stream.readline()
+
+            if(len(line) == 0):
+                return {}
+
+            if(gen.has_docstring_quotes(line)):
+                num_indicator += 1
+
+            if(num_indicator > 0):
+                line = line.lstrip()
+                docstring_content.append(line)
+
+        if(gen.validate_docstring(docstring_content, file_path) is False):
+            return {}
+
+        docstring_content = gen.strip_docstring(docstring_content)
+
+        model_kv = {}
+        delimitorLen = len(gen.jsonFieldDelimitor)
+        found_set = set()
+        keyString, valueString = "", ""
+
+        for i in range(1, len(docstring_content)-1):
+            line = docstring_content[i]
+            delimitorIndex = line.find(gen.jsonFieldDelimitor)
+
+            if(delimitorIndex != -1 and
+                delimitorIndex+1 < len(line) and
+                    line[delimitorIndex+1].isspace()):
+                lineKey = line[:delimitorIndex]
+
+                if(lineKey in found_set):
+                    gen.script_output("FOUND DUPLICATE FIELD: " + lineKey)
+                    gen.script_output("in " + file_path, False)
+                    gen.saw_error = True
+                    return {}
+
+                if(lineKey in gen.jsonFields):
+                    if(len(valueString) > 0):
+                        model_kv[keyString] = gen.convert_valString(
+                            gen.clean_valString(valueString))
+
+                    found_set.add(lineKey)
+                    v_start = len(lineKey) + delimitorLen
+                    keyString = lineKey
+                    valueString = line[v_start:]
+                else:
+                    gen.script_output("UNKNOWN KEY " + repr(lineKey))
+                    gen.saw_error = True
+                    return {}
+            else:
+                valueString += line
+
+        model_kv[keyString] = \
+            gen.convert_valString(gen.clean_valString(valueString))
+
+        if(gen.validate_model(model_kv, found_set) is False):
+            return {}
+
+        return model_kv
+
+
+def run_parser(parser, file_path):
+    """
+        Runs parser on file_path from a clean slate
+        Returns (model_kv, saw_error, messages)
+        params: (function, str) -> (dict, bool, str)
+    """
+    json_generator.saw_error = False
+    json_generator.parse_cache.clear()
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        model_kv = parser(file_path)
+
+    return (model_kv, json_generator.saw_error, output.getvalue())
+
+
+def diff_parsers(model_files):  # ([str...]) -> [str...]
+    """
+        Runs both parsers on every model file
+        Returns the files they disagree on
+    """
+    mismatches = []
+    for model_file in model_files:
+        if(run_parser(json_generator.parse_docstring, model_file) !=
+                run_parser(legacy_parse_docstring, model_file)):
+            mismatches.append(model_file)
+
+    return mismatches
+
+
+def time_parser(parser, model_files, cold=True):
+    """
+        Times parser over every model file, with output discarded
+        cold clears json_generator's parse cache first
+        Returns the elapsed time in seconds
+        params: (function, [str...], bool) -> float
+    """
+    if(cold is True):
+        json_generator.parse_cache.clear()
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for model_file in model_files:
+            parser(model_file)
+        return time.perf_counter() - start
+
+
+def bench_parse(model_files):  # ([str...]) -> bool
+    """
+        Checks and times both parsers on model_files
+        Returns False if they disagree on any file
+    """
+    mismatches = diff_parsers(model_files)
+    for model_file in mismatches:
+        script_output("parsers disagree on " + model_file)
+
+    legacy = time_parser(legacy_parse_docstring, model_files)
+    current = time_parser(json_generator.parse_docstring, model_files)
+    cached = time_parser(json_generator.parse_docstring, model_files, False)
+
+    script_output(str(len(model_files)) + " model files, " +
+                  str(len(mismatches)) + " mismatches")
+    script_output("legacy parser: {:.3f}s".format(legacy), False)
+    script_output("parse_docstring: {:.3f}s".format(current), False)
+    script_output("parse_docstring (cached): {:.3f}s".format(cached), False)
+
+    return len(mismatches) == 0
+
+
+def bench_combine(num_known, num_incoming):  # (int, int) -> float
+    """
+        Times json_combiner.combine_models() on a synthetic registry
+        Returns the elapsed time in seconds
+    """
+    models, known_models = make_registry(num_known, num_incoming)
+    start = time.perf_counter()
+    merged = json_combiner.combine_models(models, known_models)
+    elapsed = time.perf_counter() - start
+
+    if(len(merged) != num_known + len(models) - min(num_incoming // 2,
+                                                    num_known)):
+        script_output("combine_models() lost or duplicated models")
+        exit(1)
+    if(json_combiner.is_sorted_by_id(merged) is False):
+        script_output("combine_models() result is not in ID order")
+        exit(1)
+
+    return elapsed
+
+
+def measure(function, *args):
+    """
+        Runs function(*args) twice, once timed and once under tracemalloc
+        Returns (result, seconds, peak bytes allocated)
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    try:
+        function(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return (result, elapsed, peak)
+
+
+def parse_tree(model_files):  # ([str...]) -> [dict...]
+    """
+        Parses every model file, as a batch build does (in a new process,
+        so with nothing cached)
+    """
+    json_generator.parse_cache.clear()
+    models = []
+    for model_file in model_files:
+        model_kv, digest, problems = json_generator.check_model_file(
+            model_file)
+        if(len(problems) > 0):
+            script_output("synthetic model failed to parse: " + model_file)
+            exit(1)
+        models.append(model_kv)
+
+    return models
+
+
+def save_models(dest_fp, models):  # (str, [dict...]) -> None
+    """
+        Serializes models as models.json
+    """
+    with open(dest_fp, 'w') as output_stream:
+        json_combiner.write_models(output_stream, models)
+
+
+def load_models(filepath):  # (str) -> [dict...]
+    """
+        Streams the models of a models.json file back in
+    """
+    return list(json_combiner.iter_prev_models(filepath))
+
+
+def split_registry(models, known_ratio, renamed_ratio):
+    """
+        Splits parsed models into the known models of a registry (with IDs)
+        and the incoming models of a rebuild, in which renamed_ratio of
+        the known models have a new source
+        params: ([dict...], float, float) -> ([dict...], [dict...])
+    """
+    num_known = int(len(models) * known_ratio)
+    num_renamed = int(num_known * renamed_ratio)
+
+    known_models = []
+    for number in range(num_known):
+        model = dict(models[number])
+        model[json_combiner.ID_FIELD] = number
+        known_models.append(model)
+
+    incoming = [dict(model) for model in models]
+    for number in range(num_renamed):
+        incoming[number][json_combiner.SOURCE_FIELD] += ".renamed"
+
+    return (incoming, known_models)
+
+
+def bench_suite(sizes, doc_lines, known_ratio, renamed_ratio):
+    """
+        Times and traces each phase of a registry build on synthetic model
+        trees of the given sizes
+        Returns [{"models", "phase", "seconds", "peak_bytes"}...]
+        params: ([int...], int, float, float) -> [dict...]
+    """
+    results = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            models_dir = os.path.join(tmp_dir, "models")
+            os.mkdir(models_dir)
+            write_model_tree(models_dir, size, doc_lines)
+            model_files = json_generator.find_model_files([models_dir])
+            models_fp = os.path.join(tmp_dir, "models.json")
+
+            models, parse_time, parse_peak = measure(parse_tree, model_files)
+            incoming, known_models = \
+                split_registry(models, known_ratio, renamed_ratio)
+            merged, merge_time, merge_peak = measure(
+                json_combiner.combine_models, incoming, known_models)
+            _, save_time, save_peak = measure(save_models, models_fp, merged)
+            _, load_time, load_peak = measure(load_models, models_fp)
+
+        for phase, elapsed, peak in (("parse", parse_time, parse_peak),
+                                     ("merge", merge_time, merge_peak),
+                                     ("serialize", save_time, save_peak),
+                                     ("load", load_time, load_peak)):
+            results.append({"models": size, "phase": phase,
+                            "seconds": elapsed, "peak_bytes": peak})
+            script_output("{:>7} models {:<9} {:8.3f}s {:10.1f}KiB".format(
+                size, phase, elapsed, peak / 1024), False)
+
+    return results
+
+
+def git_commit():  # () -> str
+    """
+        The commit being benchmarked, or None outside of a git checkout
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, universal_newlines=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(results, baseline, tolerance):
+    """
+        Prints results against the baseline results
+        Returns False if any phase is more than tolerance times slower
+        params: ([dict...], [dict...], float) -> bool
+    """
+    base = {}
+    for result in baseline:
+        base[(result["models"], result["phase"])] = result
+
+    ok = True
+    for result in results:
+        old = base.get((result["models"], result["phase"]))
+        if(old is None or old["seconds"] == 0):
+            continue
+        ratio = result["seconds"] / old["seconds"]
+        script_output("{:>7} models {:<9} x{:.2f} time x{:.2f} memory".format(
+            result["models"], result["phase"], ratio,
+            result["peak_bytes"] / max(old["peak_bytes"], 1)), False)
+        # Phases this short are mostly timer noise
+        if(ratio > tolerance and old["seconds"] >= MIN_COMPARE_SECONDS):
+            ok = False
+
+    return ok
+
+
+def run_suite(args):  # (Namespace) -> bool
+    """
+        Runs --suite, saves and compares its results as asked
+        Returns False if the comparison failed
+    """
+    # read the baseline first: --out and --compare may name the same file
+    baseline = None
+    if(args.compare is not None):
+        with open(args.compare, 'r') as input_stream:
+            baseline = json.load(input_stream)
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = bench_suite(sizes, args.doc_lines, args.known_ratio,
+                          args.renamed_ratio)
+
+    if(args.out is not None):
+        report = {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "doc_lines": args.doc_lines,
+            "known_ratio": args.known_ratio,
+            "renamed_ratio": args.renamed_ratio,
+            "results": results,
+        }
+        with open(args.out, 'w') as output_stream:
+            output_stream.write(json.dumps(report, sort_keys=True, indent=4))
+
+    if(baseline is not None):
+        script_output("against " + args.compare + " (commit " +
+                      str(baseline.get("commit")) + "):")
+        return compare_results(results, baseline["results"], args.tolerance)
+
+    return True
+
+
+def import_times(module):  # (str) -> {str: int}
+    """
+        Imports module in a fresh interpreter with -X importtime
+        Returns {module name: cumulative microseconds} for module and the
+        modules it imported directly (that were not loaded at startup)
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    ).stderr
+
+    # each import is listed after the ones it triggered, so the direct
+    # imports of module are the ones one level down since the last
+    # top level import
+    times = {}
+    for line in stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split("|")
+        if(len(fields) != 3 or not fields[1].strip().isdigit()):
+            continue
+        # nested imports are indented two more spaces per level
+        depth = (len(fields[2]) - len(fields[2].lstrip())) // 2
+        name = fields[2].strip()
+        if(depth == 1):
+            times[name] = int(fields[1])
+        elif(depth == 0 and name == module):
+            times[name] = int(fields[1])
+            return times
+        elif(depth == 0):
+            times = {}
+
+    return times
+
+
+def bench_imports(runs, budget):  # (int, float) -> bool
+    """
+        Prints the best of runs import times of each registry script
+        Returns False if any took longer than budget milliseconds
+    """
+    ok = True
+    for module in IMPORT_MODULES:
+        best = None
+        for run in range(runs):
+            times = import_times(module)
+            if(best is None or times[module] < best[module]):
+                best = times
+
+        elapsed = best[module] / 1000
+        slowest = sorted((name for name in best if name != module),
+                         key=lambda name: best[name], reverse=True)
+        script_output("{:<15} {:7.1f}ms ({})".format(
+            module, elapsed, ", ".join(
+                "{} {:.1f}ms".format(name, best[name] / 1000)
+                for name in slowest[:IMPORT_TOP])), False)
+        if(elapsed > budget):
+            script_output(module + " over budget of " + str(budget) + "ms")
+            ok = False
+
+    return ok
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--known", type=int, default=100000)
+    arg_parser.add_argument("--incoming", type=int, default=100000)
+    arg_parser.add_argument("--budget", type=float, default=1.0)
+    arg_parser.add_argument("--parse", action="store_true")
+    arg_parser.add_argument("--models")
+    arg_parser.add_argument("--count", type=int, default=1000)
+    arg_parser.add_argument("--doc_lines", type=int)
+    arg_parser.add_argument("--suite", action="store_true")
+    arg_parser.add_argument("--sizes", default="10,1000,100000")
+    arg_parser.add_argument("--known_ratio", type=float, default=0.5)
+    arg_parser.add_argument("--renamed_ratio", type=float, default=0.1)
+    arg_parser.add_argument("--out")
+    arg_parser.add_argument("--compare")
+    arg_parser.add_argument("--tolerance", type=float, default=1.25)
+    arg_parser.add_argument("--importtime", action="store_true")
+    arg_parser.add_argument("--runs", type=int, default=5)
+    arg_parser.add_argument("--import_budget", type=float, default=100)
+
+    args = arg_parser.parse_args()
+
+    if(args.importtime is True):
+        if(sys.version_info < (3, 7)):
+            script_output("--importtime needs Python 3.7 or later")
+            exit(1)
+        if(bench_imports(args.runs, args.import_budget) is False):
+            exit(1)
+        return
+
+    if(args.suite is True):
+        if(args.doc_lines is None):
+            args.doc_lines = 30
+        if(run_suite(args) is False):
+            exit(1)
+        return
+
+    if(args.doc_lines is None):
+        args.doc_lines = 200
+
+    if(args.parse is True):
+        if(args.models is not None):
+            ok = bench_parse(json_generator.find_model_files([args.models]))
+        else:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                write_model_tree(tmp_dir, args.count, args.doc_lines)
+                for name, content in EDGE_CASES.items():
+                    with open(os.path.join(tmp_dir, name), 'w') \
+                            as output_stream:
+                        output_stream.write(content)
+                ok = bench_parse(json_generator.find_model_files([tmp_dir]))
+
+        if(ok is False):
+            exit(1)
+        return
+
+    elapsed = bench_combine(args.known, args.incoming)
+    script_output("combine_models: " + str(args.known) + " known + " +
+                  str(args.incoming) + " incoming in " +
+                  "{:.3f}s".format(elapsed))
+
+    if(elapsed > args.budget):
+        script_output("over budget of " + str(args.budget) + "s")
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,13 @@
 #!/usr/bin/env python3
 
+import os
+import io
 import json
 import sys
+import hashlib
 import argparse
+import threading
+from json_generator import load_manifest, save_manifest, temp_path
 
 """
     Combines all *_model.json files given and optionally, models.json file
@@ -28,27 +33,53 @@ import argparse
         This is used for the script to know about previously combined models
         (Will also store back the results to the same file)
 
+    --manifest: optional flag to indicate the filepath to the build manifest
+        written by json_generator.py --manifest (needs --models_fp)
+        Models whose docstring has not changed since they were last merged
+        are skipped, and models.json is left alone if nothing changed
+        The manifest also records a content hash of the models.json it was
+        merged into. If models.json no longer matches it (it is missing, or
+        was replaced, such as by a checkout), every model is merged again
+
+    --stream: optional flag to merge with bounded memory (needs --models_fp)
+        Known models are read from models_fp one at a time and the result is
+        written back one model at a time (through a temporary file that is
+        renamed into place), along with a JSON Lines companion file
+        (models.jsonl next to models.json) that later runs read instead
+        This needs models.json in ID order, as this script saves it. One
+        that is not (edited by hand, say) is read in and sorted, once
+        The companion ends with the size and sha1 of the models.json it
+        was written with, and is only read while models.json still matches
+
+    --index: optional flag to indicate the filepath of a models index file
+        A slim, precomputed list of every model's ID, name, source and active
+        flag, for the landing page's model list. It is only rewritten if it
+        changed, along with an ETag for it in <index>.etag
+    --compress: also write gzip (<index>.gz) and, if the brotli module is
+        installed, brotli (<index>.br) versions of the index for the API
+        server to send as they are
+
     Default behavior: outputs to stdout
     Optional behavior: if given models_fp, then it will read from models_fp and
                         store result to models_fp
+
+    Library use: the Registry class does the same load / merge / save in
+    a long running process (such as the API server), without module state
 """
 
 DB_NAME = "models_database"
 ID_FIELD = "model ID"
 SOURCE_FIELD = "source"  # Used to determine new or old models
+# Fields of each model kept in the models index
+INDEX_FIELDS = [ID_FIELD, "name", SOURCE_FIELD, "active"]
 
-script_name = sys.argv[0]
-model_id = 0  # Will be init to different value if models.json is given
-result_json = {DB_NAME: []}
+READ_CHUNK = 1 << 16  # Characters read at a time when streaming
+MODEL_INDENT = " " * 8  # Indent of each model within models.json
+# Key of the last line of a JSON Lines companion, the file_digest() of the
+# models.json it was written with
+DIGEST_FIELD = "models.json digest"
 
-
-def validate_config():  # () -> None
-    """
-        Checks the configuration of this script
-    """
-    if(model_id < 0):
-        script_output("model_id can't be negative")
-        exit(1)
+script_name = sys.argv[0]
 
 
 def script_output(message, withName=True):  # (str, bool) -> None
@@ -61,43 +92,292 @@ def script_output(message, withName=True):  # (str, bool) -> None
         print(message)
 
 
-def save_result(dest_fp):
+def write_models(output_stream, models):
     """
-        Handy function to encode result_json to json and save to file
+        Writes models to output_stream one at a time, formatted exactly as
+        json.JSONEncoder(sort_keys=True, indent=4) would format
+        {DB_NAME: models}, without ever holding all of it in memory
+        models can be any iterable
     """
-    with open(dest_fp, 'w') as output_stream:
-        rawJSON = \
-            json.JSONEncoder(sort_keys=True, indent=4).encode(result_json)
-        output_stream.write(rawJSON)
+    encoder = json.JSONEncoder(sort_keys=True, indent=4)
+    separator = "\n"
+    output_stream.write("{\n    " + json.dumps(DB_NAME) + ": [")
+    for model in models:
+        output_stream.write(separator)
+        output_stream.write(
+            MODEL_INDENT +
+            encoder.encode(model).replace("\n", "\n" + MODEL_INDENT))
+        separator = ",\n"
+
+    if(separator == "\n"):  # No models at all
+        output_stream.write("]\n}")
+    else:
+        output_stream.write("\n    ]\n}")
 
 
-def print_result():
+def jsonl_path(models_fp):  # (str) -> str
     """
-        Handy function to print result_json
+        Path of the JSON Lines companion of a models.json file
     """
-    print(json.JSONEncoder(sort_keys=True, indent=4).encode(result_json))
+    return os.path.splitext(models_fp)[0] + ".jsonl"
 
 
-def get_prev_models(filepath):
+def file_digest(filepath):  # (str) -> dict
     """
-        Reads from models.json, which also happens to be our DEST_FOLDER
-        If our DEST_FOLDER doesn't exist, it will just create the new file
-        Otherwise, it will read in the json,
-        so the script knows the model ID for exisiting models
+        {"sha1": content hash, "size": bytes} of a file,
+        or None if it can't be read
     """
+    digest = hashlib.sha1()
+    size = 0
     try:
-        with open(filepath, 'r') as input_stream:
+        with open(filepath, 'rb') as input_stream:
+            for chunk in iter(lambda: input_stream.read(READ_CHUNK), b""):
+                digest.update(chunk)
+                size += len(chunk)
+    except OSError:
+        return None
+
+    return {"sha1": digest.hexdigest(), "size": size}
+
+
+def save_stream(dest_fp, models):
+    """
+        Writes models to dest_fp, and one model per line to its JSON Lines
+        companion, one model at a time. Both files are written to a
+        temporary file first and renamed into place, so models may be
+        read lazily from dest_fp itself while saving
+        The companion ends with a {DIGEST_FIELD: file_digest()} line
+        for the models.json written, see companion_digest()
+    """
+    tmp_fp = temp_path(dest_fp)
+    tmp_jsonl_fp = temp_path(jsonl_path(dest_fp))
+    try:
+        with open(tmp_fp, 'w') as output_stream, \
+                open(tmp_jsonl_fp, 'w') as jsonl_stream:
+
+            def tee(models):
+                for model in models:
+                    jsonl_stream.write(json.dumps(model, sort_keys=True))
+                    jsonl_stream.write("\n")
+                    yield model
+
+            write_models(output_stream, tee(models))
+        with open(tmp_jsonl_fp, 'a') as jsonl_stream:
+            jsonl_stream.write(json.dumps({DIGEST_FIELD: file_digest(tmp_fp)},
+                                          sort_keys=True))
+            jsonl_stream.write("\n")
+    except BaseException:
+        for fp in (tmp_fp, tmp_jsonl_fp):
+            if(os.path.exists(fp)):
+                os.remove(fp)
+        raise
+
+    # If the second rename never happens, the old companion is left with
+    # the digest of the old models.json, so it is not used
+    os.replace(tmp_fp, dest_fp)
+    os.replace(tmp_jsonl_fp, jsonl_path(dest_fp))
+
+
+def index_entry(model):  # (dict) -> dict
+    """
+        The slim version of a model kept in the models index
+        Models without an active field are active
+    """
+    entry = {}
+    for field in INDEX_FIELDS:
+        entry[field] = model.get(field)
+    if(entry["active"] is None):
+        entry["active"] = True
+
+    return entry
+
+
+def save_index(dest_fp, entries, compress=False):
+    """
+        Saves the models index (index_entry() of every model) to dest_fp,
+        with its ETag to dest_fp.etag and, if compress, pre-compressed
+        copies to dest_fp.gz (and dest_fp.br if brotli is installed)
+        Nothing is rewritten if the index did not change, so the files keep
+        their mtime for HTTP caching. Compressed copies that were not
+        written this time are removed, so none is ever older than the index
+        The ETag is written last: if a save dies partway, the next one sees
+        an ETag that does not match and rewrites everything
+        Returns the ETag
+        params: (str, [dict...], bool) -> str
+    """
+    raw = json.dumps(entries, sort_keys=True, separators=(",", ":")).encode()
+    etag = '"' + hashlib.sha1(raw).hexdigest() + '"'
+
+    outputs = [(dest_fp, raw)]
+    if(compress is True):
+        # the compressors are only imported when asked for
+        import gzip
+        # gzip.compress() only takes mtime from Python 3.8 on, and the
+        # containers run 3.6. mtime=0 keeps the output (and so the .gz
+        # file) the same for the same index
+        buffer = io.BytesIO()
+        with gzip.GzipFile(fileobj=buffer, mode="wb", mtime=0) as gz_stream:
+            gz_stream.write(raw)
+        outputs.append((dest_fp + ".gz", buffer.getvalue()))
+        try:
+            import brotli
+            outputs.append((dest_fp + ".br", brotli.compress(raw)))
+        except ImportError:
+            pass
+
+    try:
+        with open(dest_fp + ".etag", 'r') as input_stream:
+            old_etag = input_stream.read()
+    except OSError:
+        old_etag = None
+
+    written = set(fp for fp, content in outputs)
+    for fp in (dest_fp + ".gz", dest_fp + ".br"):
+        if(fp not in written and os.path.exists(fp)):
+            os.remove(fp)
+
+    outputs.append((dest_fp + ".etag", etag.encode()))
+    for fp, content in outputs:
+        if(old_etag == etag and os.path.exists(fp)):
+            continue
+        tmp_fp = temp_path(fp)
+        with open(tmp_fp, 'wb') as output_stream:
+            output_stream.write(content)
+        os.replace(tmp_fp, fp)
+
+    return etag
+
+
+class JSONStream():
+    """
+        Minimal incremental reader over a text stream of JSON
+        Only as much of the stream as the current value needs is buffered
+    """
+
+    def __init__(self, input_stream):
+        self.input_stream = input_stream
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """
+            Reads the next chunk in, dropping what was already consumed
+        """
+        chunk = self.input_stream.read(READ_CHUNK)
+        if(len(chunk) == 0):
+            self.eof = True
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+    def peek(self):
+        """
+            Returns the next non whitespace character ("" at the end)
+        """
+        while(True):
+            while(self.pos < len(self.buffer) and
+                    self.buffer[self.pos].isspace()):
+                self.pos += 1
+            if(self.pos < len(self.buffer) or self.eof):
+                return self.buffer[self.pos:self.pos+1]
+            self.fill()
+
+    def expect(self, char):
+        """
+            Consumes char, which has to be the next non whitespace character
+        """
+        if(self.peek() != char):
+            raise ValueError("expected " + repr(char) + " in JSON")
+        self.pos += 1
+
+    def value(self):
+        """
+            Decodes and consumes the next complete JSON value
+        """
+        self.peek()
+        while(True):
             try:
-                # Assumes models.json has DB_NAME that matches
-                # what the script expects
-                return json.load(input_stream)[DB_NAME]
+                obj, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number may continue past the end of what we have read
+                if(end < len(self.buffer) or self.eof):
+                    self.pos = end
+                    return obj
             except ValueError:
-                script_output("Invalid JSON in " + filepath)
-                exit(1)
+                if(self.eof):
+                    raise
+            self.fill()
+
+
+def stream_prev_models(input_stream):
+    """
+        Yields the models of a models.json stream one at a time
+        Raises ValueError if the JSON is invalid or has no DB_NAME
+    """
+    reader = JSONStream(input_stream)
+    found = False
+    reader.expect("{")
+    while(reader.peek() != "}"):
+        key = reader.value()
+        reader.expect(":")
+        if(key == DB_NAME):
+            found = True
+            reader.expect("[")
+            while(reader.peek() != "]"):
+                yield reader.value()
+                if(reader.peek() == ","):
+                    reader.expect(",")
+            reader.expect("]")
+        else:
+            reader.value()
+        if(reader.peek() == ","):
+            reader.expect(",")
+    reader.expect("}")
+
+    if(found is False):
+        raise ValueError(DB_NAME + " not found")
+
+
+def companion_digest(companion_fp):  # (str) -> dict
+    """
+        The file_digest() of the models.json a JSON Lines companion was
+        written with (its last line), or None if it has none
+    """
+    try:
+        with open(companion_fp, 'rb') as input_stream:
+            input_stream.seek(0, os.SEEK_END)
+            input_stream.seek(max(0, input_stream.tell() - READ_CHUNK))
+            last_line = input_stream.read().rstrip().rsplit(b"\n", 1)[-1]
+        trailer = json.loads(last_line.decode())
+    except (OSError, ValueError):
+        return None
+
+    if(type(trailer) != dict):
+        return None
+    return trailer.get(DIGEST_FIELD)
 
-    except OSError:
-        script_output("Could not open " + filepath)
-        exit(1)
+
+def iter_prev_models(filepath):
+    """
+        Yields the known models of a models.json file one at a time
+        Reads the JSON Lines companion of filepath if it was written with
+        filepath as it is now (same size and sha1, which costs a read of
+        filepath but no JSON parsing), else reads filepath itself
+        incrementally. mtimes are not used: copies and checkouts keep or
+        set them without regard to the content
+    """
+    companion_fp = jsonl_path(filepath)
+    digest = companion_digest(companion_fp)
+    if(digest is not None and digest == file_digest(filepath)):
+        with open(companion_fp, 'r') as input_stream:
+            for line in input_stream:
+                if(len(line.strip()) > 0):
+                    model = json.loads(line)
+                    if(DIGEST_FIELD not in model):
+                        yield model
+    else:
+        with open(filepath, 'r') as input_stream:
+            yield from stream_prev_models(input_stream)
 
 
 def get_models(model_files):
@@ -123,55 +403,93 @@ def get_models(model_files):
     return model
 
 
-def init_model_id(known_models):
+def index_models(models):
     """
-        Sets model_id to be the next avaliable or free id for use
-        Its based on whether there are existing models that the script is aware
-        of. (if models.json doesn't exist, then it assume no existing models
-        were ever created)
-        model_id will default to 0 if no known model id were used
+        Indexes models by their source field, {source: model}
+        Raises ValueError if two models share a source, as there would be
+        no telling which of them a known model with that source is
     """
-    global model_id
-
-    ids = []
-    for model in known_models:
-        ids.append(model[ID_FIELD])
+    index = {}
+    for model in models:
+        if(model[SOURCE_FIELD] in index):
+            raise ValueError("more than one model has source " +
+                             repr(model[SOURCE_FIELD]))
+        index[model[SOURCE_FIELD]] = model
 
-    if(len(ids) > 0):
-        model_id = max(ids)+1
+    return index
 
 
-def get_model_id(targetValue, known_models):
+def is_sorted_by_id(models):
     """
-        Gets the model id for the model with given targetValue
-        targetValue should be the source since its used as the unique feature
-        of each model
+        Checks if models are in ascending model ID order
     """
-    id = -1
-    for model in known_models:
-        if(targetValue == model[SOURCE_FIELD]):
-            id = model[ID_FIELD]
-            break
+    for i in range(1, len(models)):
+        if(models[i-1][ID_FIELD] > models[i][ID_FIELD]):
+            return False
 
-    return id
+    return True
 
 
-def has_model(targetValue, models):
+class OrderError(ValueError):
     """
-        Checks if a model exists with given targetValue
-        Model should have source_field
+        Raised by merge_models() when known models are not in ID order
     """
-    for model in models:
-        if(targetValue == model[SOURCE_FIELD]):
-            return True
 
-    return False
 
+def merge_models(models, known_models, next_id=0, assigned=None):
+    """
+        Generator behind combine_models(), yields the merged models in ID
+        order one at a time. known_models can be any iterable (such as
+        iter_prev_models()), but must already be in ID order
+        Raises OrderError if it is not, ValueError if two of models share
+        a source
+
+        New models get IDs from next_id on, and past every known ID
+        models are copied rather than given their ID in place
+        assigned, if given, is filled with {source: model ID} for models
+    """
+    incoming = index_models(models)
+    merged = set()  # sources of models that are in both
+    last_id = None
+
+    # Keep models that are in known_models, but not in models
+    # Do not want to erase known_models if it happened to be more up to date
+    # than what we have in registry/models
+    # Models that are in both take the place (and ID) of the known model
+    for model in known_models:
+        if(last_id is not None and model[ID_FIELD] < last_id):
+            raise OrderError("known models are not in ID order")
+        last_id = model[ID_FIELD]
+
+        source = model[SOURCE_FIELD]
+        if(source in merged):
+            continue
+        if(source in incoming):
+            merged.add(source)
+            model = dict(incoming[source])
+            model[ID_FIELD] = last_id
+            if(assigned is not None):
+                assigned[source] = last_id
+        yield model
+
+    if(last_id is not None):
+        next_id = max(next_id, last_id + 1)
+
+    # Assign new models with unique IDs
+    for model in models:
+        if(model[SOURCE_FIELD] not in merged):
+            model = dict(model)
+            model[ID_FIELD] = next_id
+            if(assigned is not None):
+                assigned[model[SOURCE_FIELD]] = next_id
+            next_id += 1
+            yield model
 
-def combine_models(models, known_models=[]):
+
+def combine_models(models, known_models=None, assigned=None):
     """
         Merges known models (from models.json) with models from
-        model.json files
+        model.json files, returns the merged list of models
 
         models.json could have models that don't have a model.json files
 
@@ -184,39 +502,179 @@ def combine_models(models, known_models=[]):
         This does mean that if a model's source is changed,
         a new model id is assigned.
         The old instance of the model will remain in models.json
+
+        Models are looked up by source in a dict, so the merge is linear.
+        Known models are walked in ID order and new models get IDs past
+        every known one, so the result comes out in ID order without sorting
     """
-    global model_id
-    new_models = []
+    if(known_models is None):
+        known_models = []
 
-    # Add models that are in known_models, but not in models to our result
-    # Do not want to erase known_models if it happened to be more up to date
-    # than what we have in registry/models
-    for model in known_models:
-        if(has_model(model[SOURCE_FIELD], models) is False):
-            result_json[DB_NAME].append(model)
+    # models.json is saved in ID order, so this is normally a no-op
+    if(is_sorted_by_id(known_models) is False):
+        known_models = sorted(known_models, key=lambda model: model[ID_FIELD])
 
-    # process the exisiting / known models first
-    for model in models:
-        knownID = get_model_id(model[SOURCE_FIELD], known_models)
-        if(knownID == -1):
-            new_models.append(model)
-        else:
-            model[ID_FIELD] = knownID
-            result_json[DB_NAME].append(model)
+    return list(merge_models(models, known_models, assigned=assigned))
 
-    # Assign new models with unique IDs
-    for model in new_models:
-        model[ID_FIELD] = model_id
-        result_json[DB_NAME].append(model)
-        model_id += 1
 
-    # Sort it out for neatness based on ID
-    result_json[DB_NAME].sort(key=lambda model: model[ID_FIELD])
+class Registry():
+    """
+        The models of a models.json file, in ID order
+
+        Keeps no module state, so any number of registries can be loaded,
+        merged into and saved by a long running process. Safe to share
+        between threads: merges are serialized, and each one swaps in a new
+        list of models, so readers of models always see a complete registry.
+        Saves are serialized too (each writes the registry as it is when
+        its turn comes), through temporary files unique to the thread
+    """
+
+    def __init__(self, models=None):
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.models = []
+        if(models is not None):
+            self.models = combine_models([], models)
+
+    def load(self, filepath):  # (str) -> None
+        """
+            Loads the models of filepath (a models.json file),
+            replacing any models already in the registry
+            Raises OSError if it can't be read, ValueError if invalid
+        """
+        models = list(iter_prev_models(filepath))
+        if(is_sorted_by_id(models) is False):
+            models.sort(key=lambda model: model[ID_FIELD])
+        with self.lock:
+            self.models = models
+
+    def merge(self, models):  # ([dict...]) -> {str: int}
+        """
+            Merges models (as parsed from *_model.json files) into the
+            registry, see combine_models()
+            The given models are not modified
+            Returns {source: model ID} for the given models
+            Raises ValueError if two of them share a source
+        """
+        assigned = {}
+        with self.lock:
+            self.models = list(
+                merge_models(models, self.models, assigned=assigned))
+        return assigned
+
+    def write(self, output_stream):
+        """
+            Writes the registry to output_stream in the models.json format
+        """
+        write_models(output_stream, self.models)
+
+    def index(self):  # () -> [dict...]
+        """
+            The models index of the registry, see index_entry()
+        """
+        return [index_entry(model) for model in self.models]
+
+    def save(self, dest_fp, jsonl=False):  # (str, bool) -> None
+        """
+            Saves the registry to dest_fp (and its JSON Lines companion if
+            jsonl) through a temporary file that is renamed into place
+        """
+        with self.save_lock:
+            models = self.models
+            if(jsonl is True):
+                save_stream(dest_fp, models)
+                return
+
+            tmp_fp = temp_path(dest_fp)
+            try:
+                with open(tmp_fp, 'w') as output_stream:
+                    write_models(output_stream, models)
+            except BaseException:
+                if(os.path.exists(tmp_fp)):
+                    os.remove(tmp_fp)
+                raise
+            os.replace(tmp_fp, dest_fp)
 
 
-def main():
-    validate_config()
+def check_models_json(models_fp, manifest):  # (str, dict) -> bool
+    """
+        Checks that models_fp is the models.json the manifest last recorded
+        (see record_models_json()). If it is not, the manifest forgets
+        which models were merged, so they are all merged again
+        Returns True if it is
+    """
+    key = os.path.normpath(models_fp)
+    if(key in manifest and manifest[key] == file_digest(models_fp)):
+        return True
+
+    manifest.pop(key, None)
+    for entry in manifest.values():
+        entry.pop("merged", None)
+    return False
+
+
+def record_models_json(models_fp, manifest):  # (str, dict) -> None
+    """
+        Records the content hash of models_fp, as just saved, in the
+        manifest under its path
+    """
+    manifest[os.path.normpath(models_fp)] = file_digest(models_fp)
+
+
+def pending_model_files(model_files, manifest):
+    """
+        Filters model_files down to those that have not been merged
+        since their docstring last changed, according to the manifest
+    """
+    merged = set()
+    for entry in manifest.values():
+        if("model_json" in entry and entry.get("merged") == entry["hash"] and
+                (ID_FIELD in entry or len(entry["model_kv"]) == 0)):
+            merged.add(entry["model_json"])
+
+    return [file for file in model_files
+            if os.path.normpath(file) not in merged]
+
+
+def manifest_sources(model_files, manifest):  # ([str...], dict) -> dict
+    """
+        {source: [*_model.json files...]} of the model_files the manifest
+        has parsed fields for, whether they are pending or not, so that
+        a merge of just the pending ones still sees every source in use
+    """
+    given = set(os.path.normpath(file) for file in model_files)
+    sources = {}
+    for entry in manifest.values():
+        if(entry.get("model_json") in given and
+                SOURCE_FIELD in entry["model_kv"]):
+            sources.setdefault(entry["model_kv"][SOURCE_FIELD], []).append(
+                entry["model_json"])
+
+    return sources
 
+
+def record_merged(model_files, ids, manifest):
+    """
+        Records the model ID assigned to each merged model in the manifest
+        along with the docstring hash it was merged at
+        ids is {source: model ID} of the merged models
+    """
+    entries = {}
+    for entry in manifest.values():
+        if("model_json" in entry):
+            entries[entry["model_json"]] = entry
+
+    for file in model_files:
+        entry = entries.get(os.path.normpath(file))
+        if(entry is None):
+            continue
+        source = entry["model_kv"].get(SOURCE_FIELD)
+        if(source in ids):
+            entry[ID_FIELD] = ids[source]
+        entry["merged"] = entry["hash"]
+
+
+def main():
     arg_parser = argparse.ArgumentParser()
     arg_parser.add_argument(
         "filenames", nargs="+",
@@ -226,42 +684,142 @@ def main():
         "--models_fp",
         help="indicate path to models.json file"
     )
+    arg_parser.add_argument(
+        "--manifest",
+        help="indicate path to the build manifest, skips unchanged models"
+    )
+    arg_parser.add_argument(
+        "--stream", action="store_true",
+        help="read and write models.json one model at a time"
+    )
+    arg_parser.add_argument(
+        "--index",
+        help="indicate path to write the slim models index to"
+    )
+    arg_parser.add_argument(
+        "--compress", action="store_true",
+        help="also write pre-compressed copies of the models index"
+    )
 
     args = arg_parser.parse_args()
 
     model_files = args.filenames
     models_json_fp = args.models_fp
 
-    # Step 1: try to load models from models.json if given
-    prev_models = []
+    if(models_json_fp is not None and
+            models_json_fp.endswith(".json") is False):
+        script_output("--models_fp is not referring to a *.json file")
+        script_output("Please check your path", False)
+        exit(1)
+
+    if(args.stream is True and models_json_fp is None):
+        script_output("--stream needs --models_fp")
+        exit(1)
 
-    if(models_json_fp is not None):
-        if(models_json_fp.endswith(".json") is False):
-            script_output("--models_fp is not referring to a *.json file")
-            script_output("Please check your path", False)
+    manifest = None
+    if(args.manifest is not None):
+        if(models_json_fp is None):
+            script_output("--manifest needs --models_fp")
             exit(1)
 
-        prev_models = get_prev_models(models_json_fp)
+        manifest = load_manifest(args.manifest)
+        # Only pending models are merged below, so check every model's
+        # source here, as a full merge would
+        for source, files in sorted(manifest_sources(
+                model_files, manifest).items()):
+            if(len(files) > 1):
+                script_output("Problem in *_model.json files: more than one "
+                              "model has source " + repr(source) + " (" +
+                              ", ".join(sorted(files)) + ")")
+                exit(1)
 
-    # Step 2: load models in from given list of *_model.json files
+        check_models_json(models_json_fp, manifest)
+        model_files = pending_model_files(model_files, manifest)
+        if(len(model_files) == 0 and
+                (args.index is None or os.path.exists(args.index))):
+            # Nothing changed since the last merge
+            return
+
+    # Step 1: load models in from given list of *_model.json files
     models = get_models(model_files)
+    try:
+        index_models(models)
+    except ValueError as err:
+        script_output("Problem in *_model.json files: " + str(err))
+        exit(1)
+    ids = {}
+    index = []
 
-    # Step 3: change the init value of model_id to be
-    # max(prev_model[model_id]) + 1
-    init_model_id(prev_models)
+    def collect_index(models):
+        # Only with --index, so --stream otherwise holds no more than the
+        # *_model.json models in memory
+        if(args.index is None):
+            return models
+        return (collect_entry(model) for model in models)
 
-    # Step 4: Combine models from models.json (known models) +
-    # *_model.json (potentially new models)
-    combine_models(models, prev_models)
+    def collect_entry(model):
+        index.append(index_entry(model))
+        return model
 
-    # If not none, then we have to save our result back to models_json_fp
-    # We cannot use redirection because that truncates the file before we get a
-    # chance to even read from models_json_fp
-    if(models_json_fp is not None):
-        save_result(models_json_fp)
-    else:
+    try:
+        if(args.stream is True):
+            # Only the *_model.json models are held in memory, known models
+            # are read from models.json while the result is written back
+            try:
+                save_stream(models_json_fp, collect_index(merge_models(
+                    models, iter_prev_models(models_json_fp), assigned=ids)))
+            except OrderError:
+                # Nothing was saved: sort the known models in memory this
+                # once, models.json is in ID order for the next run
+                ids.clear()
+                del index[:]
+                save_stream(models_json_fp, collect_index(combine_models(
+                    models, list(iter_prev_models(models_json_fp)), ids)))
+        else:
+            # Step 2: load the known models from models.json if given
+            registry = Registry()
+            if(models_json_fp is not None):
+                registry.load(models_json_fp)
+
+            # Step 3: Combine models from models.json (known models) +
+            # *_model.json (potentially new models)
+            ids = registry.merge(models)
+            index = registry.index()
+
+            # If not none, then we have to save our result back to
+            # models_json_fp. We cannot use redirection because that
+            # truncates the file before we get a chance to even read from it
+            if(models_json_fp is not None):
+                registry.save(models_json_fp)
+    except OSError:
+        script_output("Could not open " + models_json_fp)
+        exit(1)
+    except ValueError as err:
+        script_output("Invalid JSON in " + models_json_fp + ": " + str(err))
+        exit(1)
+
+    if(models_json_fp is None):
         # Output result to stdout
-        print_result()
+        try:
+            registry.write(sys.stdout)
+            print()
+            sys.stdout.flush()
+        except OSError as err:
+            # Such as the reader of a pipe (head, say) going away; stdout is
+            # pointed at devnull so exiting does not fail to flush it again
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            if(isinstance(err, BrokenPipeError) is False):
+                sys.stderr.write(script_name + ": could not write models: " +
+                                 str(err) + "\n")
+            exit(1)
+
+    if(args.index is not None):
+        save_index(args.index, index, args.compress)
+
+    if(manifest is not None):
+        record_merged(model_files, ids, manifest)
+        record_models_json(models_json_fp, manifest)
+        save_manifest(args.manifest, manifest)
 
 
 if __name__ == "__main__":
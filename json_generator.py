@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 
+import os
 import sys
 import json
-import distutils.util
+import hashlib
 import argparse
+import threading
 """
     Script to generate a *_model.json file, given *.py
     *.py file must have docstring at the header of the file first
@@ -13,6 +15,28 @@ import argparse
 """
     usage / options
     ./json_generator filename
+    ./json_generator --outdir DIR [--jobs N] [--manifest FP] paths...
+    ./json_generator --check [--jobs N] paths...
+
+    Default behavior: parses a single model file and outputs to stdout
+    Batch behavior: with --outdir, every given file (and every *.py file in
+                    any given directory) is parsed in this one process and
+                    written to DIR/<name>_model.json
+                    --jobs N spreads the files over a pool of N processes
+                    Errors are reported per file; exit status is 1 if any
+                    file failed
+
+    --manifest: optional flag to indicate the filepath to a build manifest
+        The manifest records a content hash of each model's docstring along
+        with its parsed fields, so only models whose docstring changed are
+        parsed and written again. json_combiner.py records the model IDs it
+        assigns in the same manifest (see its --manifest flag)
+
+    Check behavior: with --check, every given model is validated (in a pool
+                    of --jobs processes, one per CPU by default) and a JSON
+                    report of every problem found, with its file and line,
+                    is output to stdout. Nothing is written, exit status is
+                    1 if there were any problems
 """
 
 # Docstring format
@@ -35,6 +59,14 @@ script_name = sys.argv[0]
 jsonFieldDelimitor = ":"
 saw_error = False
 
+# Strings strtobool() accepts (the same as the old distutils.util.strtobool)
+TRUE_STRINGS = set(["y", "yes", "t", "true", "on", "1"])
+FALSE_STRINGS = set(["n", "no", "f", "false", "off", "0"])
+
+# Parses without problems, {file_path: (mtime_ns, size, model_kv, hash)}
+# (see cached_parse())
+parse_cache = {}
+
 
 def validate_config():  # () -> None
     """
@@ -71,35 +103,69 @@ def has_docstring_quotes(line):  # (str) -> bool
     return False
 
 
-def validate_docstring(content, filename, withOutput=True):
+def report_problem(problems, file_path, line, message, details=()):
+    """
+        Reports a problem found in a model file
+        With problems=None (the CLI) it is printed and saw_error is set,
+        otherwise it is appended to problems as a dict with the
+        "file", "line", "message" and "details" of the problem
+
+        params: ([dict...], str, int, str, (str...)) -> None
+    """
+    global saw_error
+    if(problems is None):
+        script_output(message)
+        for detail in details:
+            script_output(detail, False)
+        saw_error = True
+    else:
+        problems.append({"file": file_path, "line": line,
+                         "message": message, "details": list(details)})
+
+
+def validate_docstring(content, filename, withOutput=True, problems=None,
+                       first_line=1):
     """
         Function to validate the contents of a given docstring
         pass in filename for error messages
+        problems and first_line (the line number of content[0]) are
+        passed on to report_problem()
 
-        params: ([str...], str, bool) -> bool
+        params: ([str...], str, bool, [dict...], int) -> bool
     """
-    global saw_error
     MIN_DOCLEN = 2  # Min len of the docstring should be at least 2 lines
     QUOTE_LEN = 4  # len of a """ or ''' (counting newline)
 
     if(len(content) < MIN_DOCLEN):
         if(withOutput):
-            script_output("docstring too short in " + filename)
-            saw_error = True
+            report_problem(problems, filename, first_line,
+                           "docstring too short in " + filename)
         return False
 
-    if(len(content[0].strip()) > QUOTE_LEN or
-            len(content[len(content)-1].strip()) > QUOTE_LEN):
-        if(withOutput):
-            script_output("docstring quotes should be in a line by itself")
-            script_output("Problem in " + filename, False)
-            saw_error = True
-        return False
+    for i in (0, len(content)-1):
+        if(len(content[i].strip()) > QUOTE_LEN):
+            if(withOutput):
+                report_problem(
+                    problems, filename, first_line + i,
+                    "docstring quotes should be in a line by itself",
+                    ["Problem in " + filename])
+            return False
 
     return True
 
 
-def validate_model(model_kv, key_set):
+def field_list(fields, problems):  # (set, [dict...]) -> str
+    """
+        fields as text for a problem message. Sorted when collecting
+        problems, so the --check report is the same from run to run
+        (set order changes with hash randomization); printed as before
+    """
+    if(problems is None):
+        return str(fields)
+    return str(sorted(fields))
+
+
+def validate_model(model_kv, key_set, problems=None, file_path="", line=0):
     """
         Method to check if docstring we read in is valid
         Things to check for:
@@ -108,34 +174,34 @@ def validate_model(model_kv, key_set):
         3.) Duplicate keys
 
         key_set is the set of unique keys in model_kv
+        problems, file_path and line (of the docstring) are passed on to
+        report_problem()
     """
-    global saw_error
     # In case, file had a docstring, but it wasn't what we were expecting
     if(len(key_set) == 0):
-        script_output("Didn't find any known fields.")
-        script_output("Fields should be in the following format:", False)
-        script_output("<key>: <value>\n", False)
-        script_output(
-            "Please make sure your FIRST docstring has all the fields:", False)
-        script_output(str(jsonFields), False)
-        saw_error = True
+        report_problem(
+            problems, file_path, line, "Didn't find any known fields.",
+            ["Fields should be in the following format:",
+             "<key>: <value>\n",
+             "Please make sure your FIRST docstring has all the fields:",
+             field_list(jsonFields, problems)])
         return False
 
     # Missing fields
     if(len(key_set) != len(jsonFields)):
-        script_output("Missing required fields: " + str(jsonFields - key_set))
-        script_output(
-            "Please make sure to put a space after delimitor", False)
-        script_output(
-            "Current delimitor: " + repr(jsonFieldDelimitor[0]), False)
-        saw_error = True
+        report_problem(
+            problems, file_path, line,
+            "Missing required fields: " +
+            field_list(jsonFields - key_set, problems),
+            ["Please make sure to put a space after delimitor",
+             "Current delimitor: " + repr(jsonFieldDelimitor[0])])
         return False
 
     # If for some random reason duplicates were not filtered during parsing
     if(len(model_kv) != len(jsonFields)):
-        script_output(
+        report_problem(
+            problems, file_path, line,
             "script error, model_kv is not the same len as jsonFields")
-        saw_error = True
         return False
 
     return True
@@ -183,6 +249,20 @@ def clean_valString(valString):
     return result
 
 
+def strtobool(valString):  # (str) -> bool
+    """
+        Converts a string representing truth to True or False
+        Stands in for distutils.util.strtobool, distutils is gone in 3.12
+        Raises ValueError if valString is not a bool value
+    """
+    valString = valString.lower()
+    if(valString in TRUE_STRINGS):
+        return True
+    if(valString in FALSE_STRINGS):
+        return False
+    raise ValueError("invalid truth value " + repr(valString))
+
+
 def convert_valString(valString):
     """
         Function to attempt to convert the string to its actual type
@@ -196,23 +276,95 @@ def convert_valString(valString):
         return int(valString)
     except ValueError:
         try:
-            # This returns 0,1 if the string is a bool value
-            # bool() then converts it into True or False
-            return bool(distutils.util.strtobool(valString))
+            return strtobool(valString)
         except ValueError:
             return valString
     except Exception:
         return valString
 
 
+def locate_docstring(file_path):  # (str) -> (int, [str...])
+    """
+        Reads in the lines of the first docstring (quote lines included)
+        and prestrips their leading whitespaces
+        Returns (line number of the opening quotes, lines),
+        or (0, []) if the file has no docstring
+
+        The docstring is found as the line by line parser always found it:
+        it runs from the first line with triple quotes (of either kind) to
+        the next such line, whatever comes before it, and a one line
+        docstring only opens it. One pass, with one substring test per
+        line, and the file is not read past the closing quotes
+    """
+    with open(file_path, 'r') as input_stream:
+        first_line = 0
+        for line in input_stream:
+            first_line += 1
+            if("\"\"\"" in line or "'''" in line):
+                break
+        else:
+            return (0, [])
+
+        docstring_content = [line.lstrip()]
+        for line in input_stream:
+            docstring_content.append(line.lstrip())
+            if("\"\"\"" in line or "'''" in line):
+                return (first_line, docstring_content)
+
+        return (0, [])
+
+
+def read_docstring(file_path):  # (str) -> [str...]
+    """
+        The docstring lines of locate_docstring(), without the line number
+    """
+    return locate_docstring(file_path)[1]
+
+
+def docstring_hash(docstring_content):  # ([str...]) -> str
+    """
+        Content hash of a docstring read in by read_docstring()
+        Used by the build manifest to tell if a model has changed
+    """
+    return hashlib.sha1("".join(docstring_content).encode()).hexdigest()
+
+
+def cached_parse(file_path, stat):
+    """
+        The (model_kv, docstring hash) parse_cache holds for file_path, if
+        it was parsed without problems when it had stat's mtime and size,
+        else None
+        params: (str, os.stat_result) -> (dict, str)
+    """
+    cached = parse_cache.get(file_path)
+    if(cached is None or cached[0] != stat.st_mtime_ns or
+            cached[1] != stat.st_size):
+        return None
+
+    return (dict(cached[2]), cached[3])
+
+
+def cache_parse(file_path, stat, model_kv, digest):
+    """
+        Adds a parse of file_path without problems to parse_cache
+        params: (str, os.stat_result, dict, str) -> None
+    """
+    parse_cache[file_path] = \
+        (stat.st_mtime_ns, stat.st_size, dict(model_kv), digest)
+
+
 def parse_docstring(file_path):
     """
         parses the docstring at the top of every model file
         returns a [] with tuples (KEY, VAL) in the order of the jsonFields
         general expected form: <key>: <value>
 
+        Results are cached by the file's mtime and size, so parsing an
+        unchanged file again (batch or long running use) is just a stat
+
         Parsing logic
-        1.) Reading in lines between docstring quotes and prestrip
+        1.) Reading in the lines of the first docstring in a single
+        pass (see locate_docstring()) and prestrip
         leading whitespaces
         2.) Checks if docstring is empty or docstring quotes on same line
         (Stops parsing if true)
@@ -224,80 +376,121 @@ def parse_docstring(file_path):
         4.) return the result if our result was validated
     """
     global saw_error
-    with open(file_path, 'r') as input_stream:
-        # Step 1:
-        # Read everything from the docstring in first for processing
-        docstring_content = []
-        num_indicator = 0  # Indicators of docstring quotes
-        while(num_indicator < 2):
-            line = input_stream.readline()
-
-            if(len(line) == 0):
-                return {}
-
-            if(has_docstring_quotes(line)):
-                num_indicator += 1
-
-            # We have entered a docstring
-            if(num_indicator > 0):
-                # Prestrip whitespaces in front of line
-                line = line.lstrip()
-                docstring_content.append(line)
-
-        # If invalid docstring, return empty
-        if(validate_docstring(docstring_content, file_path) is False):
-            return {}
-
-        # Remove leading and trailing lines
-        docstring_content = strip_docstring(docstring_content)
-
-        # Step 2: Now we process the docstring
-        model_kv = {}  # model's key val pair for the json
-        delimitorLen = len(jsonFieldDelimitor)
-        found_set = set()
-        keyString, valueString = "", ""
-
-        for i in range(1, len(docstring_content)-1):
-            line = docstring_content[i]
-            delimitorIndex = line.find(jsonFieldDelimitor)
-
-            # Found sign of a key
-            if(delimitorIndex != -1 and
-                delimitorIndex+1 < len(line) and
-                    line[delimitorIndex+1].isspace()):
-                lineKey = line[:delimitorIndex]
-
-                if(lineKey in found_set):
-                    script_output("FOUND DUPLICATE FIELD: " + lineKey)
-                    script_output("in " + file_path, False)
-                    saw_error = True
-                    return {}
+    stat = os.stat(file_path)
+    cached = cached_parse(file_path, stat)
+    if(cached is not None):
+        return cached[0]
 
-                if(lineKey in jsonFields):
-                    if(len(valueString) > 0):
-                        model_kv[keyString] = \
-                            convert_valString(clean_valString(valueString))
-
-                    found_set.add(lineKey)
-                    v_start = len(lineKey) + delimitorLen
-                    keyString = lineKey
-                    valueString = line[v_start:]
-                else:
-                    # stop parsing since we found a rogue key
-                    script_output("UNKNOWN KEY " + repr(lineKey))
-                    saw_error = True
+    was_error, saw_error = saw_error, False
+    first_line, docstring_content = locate_docstring(file_path)
+    model_kv = parse_docstring_content(docstring_content, file_path,
+                                       first_line=first_line)
+
+    # Failed parses are not cached, so their problems are reported again
+    if(saw_error is False):
+        cache_parse(file_path, stat, model_kv,
+                    docstring_hash(docstring_content))
+
+    saw_error = saw_error or was_error
+    return model_kv
+
+
+def parse_docstring_content(docstring_content, file_path, problems=None,
+                            first_line=1):
+    """
+        Steps 2 to 4 of parse_docstring(), given the docstring lines
+        read in by locate_docstring()
+        pass in file_path for error messages
+        problems and first_line (the line number of the opening quotes) are
+        passed on to report_problem()
+
+        When collecting problems, parsing does not stop at a duplicate or
+        unknown key: the line is reported, its value skipped, and the rest
+        is still parsed and validated, so every problem is found.
+        {} is returned if there were any
+    """
+    if(len(docstring_content) == 0):
+        return {}
+
+    # If invalid docstring, return empty
+    if(validate_docstring(docstring_content, file_path, True, problems,
+                          first_line) is False):
+        return {}
+
+    # Remove leading and trailing lines
+    # (line numbers of what is left are offset by the leading ones)
+    leading = 0
+    while(leading + 1 < len(docstring_content) - 1 and
+            len(docstring_content[leading + 1]) == 0):
+        leading += 1
+    docstring_content = strip_docstring(docstring_content)
+
+    # Step 2: Now we process the docstring
+    model_kv = {}  # model's key val pair for the json
+    delimitorLen = len(jsonFieldDelimitor)
+    found_set = set()
+    keyString, valueParts = "", []
+    reported = len(problems) if problems is not None else 0
+
+    for i in range(1, len(docstring_content)-1):
+        line = docstring_content[i]
+        delimitorIndex = line.find(jsonFieldDelimitor)
+
+        # Found sign of a key
+        if(delimitorIndex != -1 and
+            delimitorIndex+1 < len(line) and
+                line[delimitorIndex+1].isspace()):
+            lineKey = line[:delimitorIndex]
+
+            valueString = "".join(valueParts)
+            if(keyString is not None and len(valueString) > 0):
+                model_kv[keyString] = \
+                    convert_valString(clean_valString(valueString))
+
+            if(lineKey in found_set):
+                report_problem(problems, file_path, first_line + leading + i,
+                               "FOUND DUPLICATE FIELD: " + lineKey,
+                               ["in " + file_path])
+                if(problems is None):
                     return {}
+                keyString, valueParts = None, []
+            elif(lineKey in jsonFields):
+                found_set.add(lineKey)
+                v_start = len(lineKey) + delimitorLen
+                keyString = lineKey
+                valueParts = [line[v_start:]]
             else:
-                valueString += line
+                # stop parsing since we found a rogue key
+                # (or, when collecting problems, skip it)
+                report_problem(problems, file_path, first_line + leading + i,
+                               "UNKNOWN KEY " + repr(lineKey))
+                if(problems is None):
+                    return {}
+                keyString, valueParts = None, []
+        elif(keyString is not None):
+            valueParts.append(line)
+
+    # Last key
+    if(keyString is not None):
+        model_kv[keyString] = \
+            convert_valString(clean_valString("".join(valueParts)))
 
-        # Last key
-        model_kv[keyString] = convert_valString(clean_valString(valueString))
+    if(validate_model(model_kv, found_set, problems, file_path,
+                      first_line) is False):
+        return {}
 
-        if(validate_model(model_kv, found_set) is False):
-            return {}
+    if(problems is not None and len(problems) > reported):
+        return {}
 
-        # Step 3: return the finished product to our caller
-        return model_kv
+    # Step 3: return the finished product to our caller
+    return model_kv
+
+
+def encode_json(model_kv):  # (dict) -> str
+    """
+        Encodes model_kv the same way for stdout and for batch output
+    """
+    return json.JSONEncoder(sort_keys=True, indent=4).encode(model_kv)
 
 
 def generate_json(model_kv):
@@ -311,22 +504,324 @@ def generate_json(model_kv):
         script_output("generate_json(dict), check function def")
         exit(1)
 
-    print(json.JSONEncoder(sort_keys=True, indent=4).encode(model_kv))
+    print(encode_json(model_kv))
+
+
+def model_json_path(model_file, dest_dir):  # (str, str) -> str
+    """
+        Maps a model file to its *_model.json file in dest_dir
+        I.E, models/basic.py -> dest_dir/basic_model.json
+    """
+    base_name = os.path.splitext(os.path.basename(model_file))[0]
+    return os.path.join(dest_dir, base_name + "_model.json")
+
+
+def find_model_files(paths):  # ([str...]) -> [str...]
+    """
+        Expands the given paths into a list of model files
+        Directories are scanned (not recursively) for *.py files
+    """
+    model_files = []
+    for path in paths:
+        if(os.path.isdir(path)):
+            for entry in sorted(os.listdir(path)):
+                if(entry.endswith(".py")):
+                    model_files.append(os.path.join(path, entry))
+        else:
+            model_files.append(path)
+
+    return model_files
+
+
+def check_model_file(model_file):
+    """
+        Parses one model file, without printing or writing anything
+        Returns (model_kv, docstring hash, problems)
+        Goes through parse_cache, so a file that has not changed since
+        this process last parsed it (as in json_watcher.py) is just a stat.
+        Worker processes each start with an empty cache
+
+        params: (str) -> (dict, str, [dict...])
+    """
+    problems = []
+    try:
+        stat = os.stat(model_file)
+        cached = cached_parse(model_file, stat)
+        if(cached is not None):
+            return (cached[0], cached[1], problems)
+        first_line, docstring_content = locate_docstring(model_file)
+    except (OSError, UnicodeDecodeError) as err:
+        report_problem(problems, model_file, 0, str(err))
+        return ({}, "", problems)
+
+    model_kv = parse_docstring_content(docstring_content, model_file,
+                                       problems, first_line)
+    digest = docstring_hash(docstring_content)
+    if(len(problems) == 0):
+        cache_parse(model_file, stat, model_kv, digest)
+    return (model_kv, digest, problems)
+
+
+def format_problem(problem):  # (dict) -> [str...]
+    """
+        Lines to print for a problem reported by check_model_file()
+    """
+    lines = ["line " + str(problem["line"]) + ": " + problem["message"]]
+    lines.extend(problem["details"])
+    return lines
+
+
+def generate_model_file(model_file, dest_dir):
+    """
+        Parses one model file and writes its *_model.json into dest_dir
+        Nothing is written if the docstring has errors
+
+        Returns (model_file, messages, model_kv, docstring hash),
+        messages is [] on success, errors writing the *_model.json
+        included
+        Runs inside a worker process when batch_generate() uses a pool
+
+        params: (str, str) -> (str, [str...], dict, str)
+    """
+    model_kv, digest, problems = check_model_file(model_file)
+    if(len(problems) > 0):
+        messages = []
+        for problem in problems:
+            messages.extend(format_problem(problem))
+        return (model_file, messages, {}, "")
+
+    try:
+        with open(model_json_path(model_file, dest_dir), 'w') \
+                as output_stream:
+            output_stream.write(encode_json(model_kv) + "\n")
+    except OSError as err:
+        return (model_file, [str(err)], {}, "")
+
+    return (model_file, [], model_kv, digest)
+
+
+def map_model_files(function, model_files, jobs, *args):
+    """
+        Returns [function(model_file, *args)...] for every model file,
+        spread over a pool of jobs processes if jobs > 1
+    """
+    if(jobs > 1 and len(model_files) > 1):
+        # imported here: it pulls in multiprocessing, which single file
+        # runs (and make's per-model rules) should not pay for
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            return list(pool.map(
+                function, model_files,
+                *[[arg] * len(model_files) for arg in args],
+                chunksize=max(1, len(model_files) // (jobs * 4))))
+
+    return [function(model_file, *args) for model_file in model_files]
+
+
+def check_models(model_files, jobs=1):  # ([str...], int) -> dict
+    """
+        Validates every model file, concurrently if jobs > 1,
+        without writing anything
+        Returns a report, {"checked": number of files, "problems": [...]},
+        with every problem found in every file (see report_problem())
+    """
+    problems = []
+    for result in map_model_files(check_model_file, model_files, jobs):
+        problems.extend(result[2])
+
+    return {"checked": len(model_files), "problems": problems}
+
+
+def temp_path(dest_fp):  # (str) -> str
+    """
+        A temporary file path next to dest_fp (so it can be renamed over
+        dest_fp), unique to this process and thread, so concurrent writers
+        of dest_fp never share, or truncate, each other's temporary file
+    """
+    return (dest_fp + "." + str(os.getpid()) + "." +
+            str(threading.get_ident()) + ".tmp")
+
+
+def write_atomic(dest_fp, text):  # (str, str) -> None
+    """
+        Writes text to dest_fp through a temporary file and a rename,
+        so readers never see a half written file
+    """
+    tmp_fp = temp_path(dest_fp)
+    with open(tmp_fp, 'w') as output_stream:
+        output_stream.write(text)
+    os.replace(tmp_fp, dest_fp)
+
+
+def load_manifest(filepath):  # (str) -> dict
+    """
+        Reads the build manifest, {model file: entry}
+        A missing manifest is the same as an empty one
+        Each entry holds the docstring "hash", the "model_json" file written
+        and the parsed "model_kv". json_combiner.py adds the "model ID" and
+        the hash it "merged" last, and an entry for models.json itself
+        with its content hash (see json_combiner.record_models_json())
+    """
+    try:
+        with open(filepath, 'r') as input_stream:
+            try:
+                return json.load(input_stream)
+            except ValueError:
+                script_output("Invalid JSON in " + filepath)
+                exit(1)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(filepath, manifest):  # (str, dict) -> None
+    """
+        Stores the build manifest back to filepath
+    """
+    write_atomic(filepath, encode_json(manifest) + "\n")
+
+
+def stale_model_files(model_files, dest_dir, manifest):
+    """
+        Filters model_files down to those whose docstring changed since
+        the manifest was written, or whose *_model.json went missing
+
+        params: ([str...], str, dict) -> [str...]
+    """
+    stale = []
+    for model_file in model_files:
+        entry = manifest.get(os.path.normpath(model_file))
+        json_fp = os.path.normpath(model_json_path(model_file, dest_dir))
+        if(entry is None or entry["model_json"] != json_fp or
+                not os.path.exists(json_fp)):
+            stale.append(model_file)
+            continue
+
+        try:
+            cached = cached_parse(model_file, os.stat(model_file))
+            if(cached is not None):
+                digest = cached[1]
+            else:
+                digest = docstring_hash(read_docstring(model_file))
+            if(digest != entry["hash"]):
+                stale.append(model_file)
+        except (OSError, UnicodeDecodeError):
+            stale.append(model_file)
+
+    return stale
+
+
+def batch_generate(model_files, dest_dir, jobs=1, manifest=None):
+    """
+        Generates *_model.json files for all model_files in one process,
+        or spread over a pool of jobs processes
+        If given a manifest, only models whose docstring changed are parsed,
+        and the manifest is updated in place
+        Returns the [(model_file, messages)...] of every file that failed
+
+        params: ([str...], str, int, dict) -> [(str, [str...])...]
+    """
+    if(manifest is not None):
+        model_files = stale_model_files(model_files, dest_dir, manifest)
+
+    results = map_model_files(generate_model_file, model_files, jobs,
+                              dest_dir)
+
+    failures = []
+    for model_file, messages, model_kv, digest in results:
+        key = os.path.normpath(model_file)
+        if(len(messages) > 0):
+            failures.append((model_file, messages))
+            if(manifest is not None):
+                manifest.pop(key, None)
+        elif(manifest is not None):
+            entry = manifest.setdefault(key, {})
+            entry["hash"] = digest
+            entry["model_json"] = \
+                os.path.normpath(model_json_path(model_file, dest_dir))
+            entry["model_kv"] = model_kv
+
+    return failures
 
 
 def main():
     arg_parser = argparse.ArgumentParser()
-    arg_parser.add_argument("filename")
+    arg_parser.add_argument(
+        "filenames", nargs="+",
+        help="model files, or directories of model files with --outdir"
+             " or --check"
+    )
+    arg_parser.add_argument(
+        "--outdir",
+        help="batch mode: write each *_model.json into this directory"
+    )
+    arg_parser.add_argument(
+        "--jobs", type=int,
+        help="number of processes to use in batch or check mode"
+    )
+    arg_parser.add_argument(
+        "--manifest",
+        help="batch mode: path to the build manifest, skips unchanged models"
+    )
+    arg_parser.add_argument(
+        "--check", action="store_true",
+        help="validate the models and output a JSON report, write nothing"
+    )
 
     args = arg_parser.parse_args()
 
-    model_file = args.filename
-
     validate_config()
 
-    generate_json(parse_docstring(model_file))
+    if(args.jobs is not None and args.jobs < 1):
+        script_output("--jobs must be at least 1")
+        exit(1)
+
+    if(args.check is True):
+        if(args.outdir is not None or args.manifest is not None):
+            script_output("--check does not write, drop --outdir/--manifest")
+            exit(1)
+
+        jobs = args.jobs if args.jobs is not None else os.cpu_count() or 1
+        report = check_models(find_model_files(args.filenames), jobs)
+        print(encode_json(report))
+
+        if(len(report["problems"]) > 0):
+            exit(1)
+        return
+
+    if(args.outdir is None):
+        if(len(args.filenames) != 1 or os.path.isdir(args.filenames[0])):
+            script_output("Use --outdir to parse more than one model file")
+            exit(1)
+
+        generate_json(parse_docstring(args.filenames[0]))
+
+        if(saw_error is True):
+            exit(1)
+        return
+
+    if(os.path.isdir(args.outdir) is False):
+        script_output("--outdir " + args.outdir + " is not a directory")
+        exit(1)
+
+    manifest = None
+    if(args.manifest is not None):
+        manifest = load_manifest(args.manifest)
+
+    model_files = find_model_files(args.filenames)
+    failures = batch_generate(model_files, args.outdir, args.jobs or 1,
+                              manifest)
+
+    if(manifest is not None):
+        save_manifest(args.manifest, manifest)
+
+    for model_file, messages in failures:
+        script_output("Problem in " + model_file)
+        for message in messages:
+            script_output("    " + message, False)
 
-    if(saw_error is True):
+    if(len(failures) > 0):
+        script_output(str(len(failures)) + " of " + str(len(model_files)) +
+                      " model files failed")
         exit(1)
 
 
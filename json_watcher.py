@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import select
+import struct
+import argparse
+import json_generator
+import json_combiner
+
+"""
+    Keeps the model registry up to date while models are being worked on
+    Watches a models directory (with inotify on Linux, by polling otherwise)
+    and, whenever a model file is saved, re-parses just that file's
+    docstring, rewrites its *_model.json, and patches the registry kept in
+    memory and models.json (and the models index, if given) on disk
+"""
+
+"""
+    Usage:
+    ./json_watcher.py --outdir DIR --models_fp FP [options] models_dir
+
+    --outdir: directory the *_model.json files go to (as json_generator.py)
+    --models_fp: path to the models.json file to keep up to date
+        (it is loaded once at startup, and must exist)
+    --manifest: optional path to the build manifest (see json_generator.py)
+        Saves that only touch a model's code, not its docstring, are skipped,
+        and the manifest is kept current for the next make models.json
+    --index: optional path to the models index (see json_combiner.py)
+    --compress: also keep pre-compressed copies of the index, as
+        json_combiner.py --compress does (without it, any are removed)
+    --debounce: milliseconds without any save before the registry is
+        updated, so a burst of saves is handled once (default 20)
+    --poll: seconds between scans when inotify is not available
+        (default 0.2)
+"""
+
+# inotify(7) event masks
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+EVENT_BUFFER = 1 << 16
+
+script_name = sys.argv[0]
+
+
+def script_output(message, withName=True):  # (str, bool) -> None
+    """
+        Wrapper for print to include the script's name
+    """
+    if(withName is True):
+        print(script_name + ": " + message)
+    else:
+        print(message)
+    sys.stdout.flush()
+
+
+class InotifyWatcher():
+    """
+        Reports model files saved, moved or deleted in a directory,
+        using the Linux inotify API through libc
+        Raises OSError if inotify is not available
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        try:
+            # imported here, as only this watcher needs them
+            import ctypes
+            import ctypes.util
+        except ImportError:
+            raise OSError("ctypes is not available")
+        libc_name = ctypes.util.find_library("c")
+        if(libc_name is None):
+            raise OSError("libc not found")
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        try:
+            self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except AttributeError:
+            raise OSError("inotify is not available")
+        if(self.fd < 0):
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if(libc.inotify_add_watch(self.fd, os.fsencode(directory),
+                                  WATCH_MASK) < 0):
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "inotify_add_watch failed on " + directory)
+
+    def changes(self, timeout):  # (float) -> set
+        """
+            Waits up to timeout seconds (forever if None) for events,
+            returns the set of model files they were about
+        """
+        changed = set()
+        if(len(select.select([self.fd], [], [], timeout)[0]) == 0):
+            return changed
+
+        try:
+            data = os.read(self.fd, EVENT_BUFFER)
+        except BlockingIOError:
+            return changed
+
+        offset = 0
+        while(offset < len(data)):
+            wd, mask, cookie, length = \
+                EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset+length].rstrip(b"\0"))
+            offset += length
+            if(name.endswith(".py")):
+                changed.add(os.path.join(self.directory, name))
+
+        return changed
+
+
+class PollingWatcher():
+    """
+        Reports model files saved or deleted in a directory by comparing
+        their mtime and size every interval seconds
+    """
+
+    def __init__(self, directory, interval):
+        self.directory = directory
+        self.interval = interval
+        self.stats = self.scan()
+
+    def scan(self):  # () -> dict
+        """
+            Returns {model file: (mtime_ns, size)} for the directory
+        """
+        stats = {}
+        for model_file in json_generator.find_model_files([self.directory]):
+            try:
+                stat = os.stat(model_file)
+                stats[model_file] = (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                pass
+
+        return stats
+
+    def changes(self, timeout):  # (float) -> set
+        """
+            Waits up to timeout seconds (forever if None) for changes,
+            returns the set of model files that changed
+        """
+        waited = 0.0
+        while(True):
+            time.sleep(self.interval if timeout is None
+                       else min(self.interval, timeout))
+            waited += self.interval
+            stats = self.scan()
+            changed = set(model_file for model_file in
+                          set(stats) | set(self.stats)
+                          if stats.get(model_file) !=
+                          self.stats.get(model_file))
+            self.stats = stats
+            if(len(changed) > 0 or
+                    (timeout is not None and waited >= timeout)):
+                return changed
+
+
+def make_watcher(directory, poll_interval):
+    """
+        Returns an InotifyWatcher for directory if inotify is available,
+        a PollingWatcher otherwise
+    """
+    try:
+        return InotifyWatcher(directory)
+    except OSError:
+        return PollingWatcher(directory, poll_interval)
+
+
+def wait_for_changes(watcher, debounce):  # (watcher, float) -> set
+    """
+        Blocks until model files change, then keeps collecting changes
+        until none came for debounce seconds
+    """
+    changed = watcher.changes(None)
+    while(True):
+        more = watcher.changes(debounce)
+        if(len(more) == 0):
+            return changed
+        changed |= more
+
+
+def source_owners(models_dir):  # (str) -> {str: str}
+    """
+        {source: model file} of every model in models_dir, as it is now
+        If two model files share a source, the first one (in file name
+        order) owns it, and the other is reported
+    """
+    owners = {}
+    for model_file in json_generator.find_model_files([models_dir]):
+        source = json_generator.check_model_file(model_file)[0].get(
+            json_combiner.SOURCE_FIELD)
+        if(source is None):
+            continue
+        if(source in owners):
+            script_output("Problem in " + model_file + ": source " +
+                          repr(source) + " is the source of " +
+                          owners[source])
+            continue
+        owners[source] = model_file
+
+    return owners
+
+
+def update_registry(changed, registry, args, manifest, owners):
+    """
+        Re-parses the changed model files, merges them into registry and
+        saves it (and the index and manifest, if given)
+        Deleted model files are left in the registry, as json_combiner.py
+        leaves them in models.json
+        A model whose source belongs to another, still existing, model
+        file (see source_owners()) is reported and not merged, as it would
+        take over that model's entry; owners is kept up to date
+        Returns the number of models merged
+        Raises OSError if the registry (or index or manifest) can't be
+        saved
+    """
+    model_files = sorted(model_file for model_file in changed
+                         if os.path.exists(model_file))
+
+    # With a manifest, batch_generate() skips the files whose docstring
+    # did not change, and pending_model_files() then leaves them out
+    failures = json_generator.batch_generate(
+        model_files, args.outdir, 1, manifest)
+    for model_file, messages in failures:
+        script_output("Problem in " + model_file)
+        for message in messages:
+            script_output("    " + message, False)
+
+    failed = set(model_file for model_file, messages in failures)
+    json_files = {}
+    for model_file in model_files:
+        if(model_file not in failed):
+            json_files[model_file] = \
+                json_generator.model_json_path(model_file, args.outdir)
+    if(manifest is not None):
+        pending = set(json_combiner.pending_model_files(
+            list(json_files.values()), manifest))
+        json_files = dict((model_file, json_file) for model_file, json_file
+                          in json_files.items() if json_file in pending)
+
+    # Not get_models(), which exits on a bad file
+    models = []
+    claimed = {}  # {source: model file} of the models to merge
+    for model_file, json_file in json_files.items():
+        try:
+            with open(json_file, 'r') as input_stream:
+                model = json.load(input_stream)
+        except (OSError, ValueError) as err:
+            script_output("Could not load " + json_file + ": " + str(err))
+            continue
+        if(len(model) == 0):
+            continue
+
+        source = model[json_combiner.SOURCE_FIELD]
+        owner = claimed.get(source, owners.get(source))
+        if(owner is not None and owner != model_file and
+                os.path.exists(owner)):
+            script_output("Problem in " + model_file + ": source " +
+                          repr(source) + " is the source of " + owner)
+            continue
+        claimed[source] = model_file
+        models.append(model)
+    if(len(models) == 0):
+        return 0
+
+    ids = registry.merge(models)
+    registry.save(args.models_fp, jsonl=True)
+
+    merged_files = set(claimed.values())
+    for source, model_file in list(owners.items()):
+        if(model_file in merged_files):
+            del owners[source]
+    owners.update(claimed)
+
+    if(args.index is not None):
+        json_combiner.save_index(args.index, registry.index(), args.compress)
+    if(manifest is not None):
+        json_combiner.record_merged(
+            [json_files[model_file] for model_file in merged_files],
+            ids, manifest)
+        json_combiner.record_models_json(args.models_fp, manifest)
+        json_generator.save_manifest(args.manifest, manifest)
+
+    return len(models)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument(
+        "models_dir",
+        help="indicate the directory of model files to watch"
+    )
+    arg_parser.add_argument(
+        "--outdir", required=True,
+        help="indicate the directory to write *_model.json files to"
+    )
+    arg_parser.add_argument(
+        "--models_fp", required=True,
+        help="indicate path to models.json file"
+    )
+    arg_parser.add_argument(
+        "--manifest",
+        help="indicate path to the build manifest"
+    )
+    arg_parser.add_argument(
+        "--index",
+        help="indicate path to the models index"
+    )
+    arg_parser.add_argument(
+        "--compress", action="store_true",
+        help="also write pre-compressed copies of the models index"
+    )
+    arg_parser.add_argument(
+        "--debounce", type=float, default=20,
+        help="milliseconds to wait for a burst of saves to end"
+    )
+    arg_parser.add_argument(
+        "--poll", type=float, default=0.2,
+        help="seconds between scans when inotify is not available"
+    )
+
+    args = arg_parser.parse_args()
+
+    registry = json_combiner.Registry()
+    try:
+        registry.load(args.models_fp)
+    except OSError:
+        script_output("Could not open " + args.models_fp)
+        exit(1)
+    except ValueError as err:
+        script_output("Invalid JSON in " + args.models_fp + ": " + str(err))
+        exit(1)
+
+    manifest = None
+    if(args.manifest is not None):
+        manifest = json_generator.load_manifest(args.manifest)
+        json_combiner.check_models_json(args.models_fp, manifest)
+
+    owners = source_owners(args.models_dir)
+    watcher = make_watcher(args.models_dir, args.poll)
+    script_output("watching " + args.models_dir + " with " +
+                  type(watcher).__name__)
+
+    try:
+        while(True):
+            changed = wait_for_changes(watcher, args.debounce / 1000)
+            start = time.perf_counter()
+            try:
+                merged = update_registry(changed, registry, args, manifest,
+                                         owners)
+            except (OSError, ValueError) as err:
+                # Keep watching, the next save tries again
+                script_output("Could not update the registry: " + str(err))
+                continue
+            if(merged > 0):
+                script_output("merged " + str(merged) + " model(s) in " +
+                              "{:.1f}ms".format(
+                                  (time.perf_counter() - start) * 1000))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -4,11 +4,58 @@ import 'chart.js';
 import PropType from 'prop-types';
 import CardWrapper from './CardWrapper';
 
+// Most periods plotted per group; longer histories are downsampled
+const MAX_POINTS = 500;
+
+/**
+ * Downsamples a population history with Largest-Triangle-Three-Buckets.
+ * Returns the indices (periods) to plot: the first and last period, and
+ * in between, the period of each bucket that keeps the most of the
+ * line's shape, so peaks and crashes survive downsampling.
+ */
+export function lttbIndices(values, maxPoints) {
+  const n = values.length;
+  if (maxPoints >= n || maxPoints < 3) {
+    return values.map((value, i) => i);
+  }
+  const indices = [0];
+  const bucketSize = (n - 2) / (maxPoints - 2);
+  let prev = 0;
+  for (let bucket = 0; bucket < maxPoints - 2; bucket += 1) {
+    const start = Math.floor(bucket * bucketSize) + 1;
+    const end = Math.floor((bucket + 1) * bucketSize) + 1;
+    // the average point of the next bucket is the triangles' third corner
+    const nextEnd = Math.min(Math.floor((bucket + 2) * bucketSize) + 1, n);
+    let avgX = 0;
+    let avgY = 0;
+    for (let i = end; i < nextEnd; i += 1) {
+      avgX += i;
+      avgY += values[i];
+    }
+    avgX /= nextEnd - end;
+    avgY /= nextEnd - end;
+    let maxArea = -1;
+    let chosen = start;
+    for (let i = start; i < end; i += 1) {
+      const area = Math.abs((prev - avgX) * (values[i] - values[prev])
+        - (prev - i) * (avgY - values[prev]));
+      if (area > maxArea) {
+        maxArea = area;
+        chosen = i;
+      }
+    }
+    indices.push(chosen);
+    prev = chosen;
+  }
+  indices.push(n - 1);
+  return indices;
+}
+
 function PopulationGraph(props) {
   const NUM_COLORS = 7;
   const colors = ['red', 'green', 'blue', 'black', 'purple', 'magenta', 'orange'];
   let thisColor = 0;
-  const { loadingData, envFile } = props;
+  const { loadingData, envFile, maxPoints } = props;
   if (loadingData) {
     const data = [];
     const env = props.envFile.pop_hist.pops;
@@ -23,9 +70,9 @@ function PopulationGraph(props) {
         data: {},
       });
       // modify individual 'data' dictionary of each pops
-      // group by copying over value
-      Object.keys(env[group]).forEach((member, iMember) => {
-        data[iGroup].data[member] = env[group][iMember];
+      // group by copying over the values of the periods we plot
+      lttbIndices(env[group], maxPoints).forEach((period) => {
+        data[iGroup].data[period] = env[group][period];
       });
       thisColor += 1;
     });
@@ -41,11 +88,13 @@ function PopulationGraph(props) {
 PopulationGraph.propTypes = {
   loadingData: PropType.bool,
   envFile: PropType.shape(),
+  maxPoints: PropType.number,
 };
 
 PopulationGraph.defaultProps = {
   loadingData: true,
   envFile: {},
+  maxPoints: MAX_POINTS,
 };
 
 export default PopulationGraph;
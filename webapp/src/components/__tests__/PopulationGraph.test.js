@@ -0,0 +1,24 @@
+import { lttbIndices } from '../PopulationGraph';
+
+describe('lttbIndices', () => {
+  it('keeps every period of a short history', () => {
+    expect(lttbIndices([3, 1, 4, 1, 5], 10)).toEqual([0, 1, 2, 3, 4]);
+  });
+
+  it('keeps at most maxPoints periods, first and last included', () => {
+    const values = Array.from({ length: 10000 }, (v, i) => i % 97);
+    const indices = lttbIndices(values, 500);
+    expect(indices).toHaveLength(500);
+    expect(indices[0]).toEqual(0);
+    expect(indices[499]).toEqual(9999);
+    indices.slice(1).forEach((period, i) => {
+      expect(period).toBeGreaterThan(indices[i]);
+    });
+  });
+
+  it('keeps a spike that falls between buckets', () => {
+    const values = new Array(1000).fill(10);
+    values[503] = 1000;
+    expect(lttbIndices(values, 50)).toContain(503);
+  });
+});